@@ -27,7 +27,7 @@ setuptools.setup(
         "six>=1.15.0",
         "urllib3>=1.26.2,<2",
         "legacy-cgi>=2.6.2; python_version>='3.10'",
-        "google-api-python-client"
+        "google-api-python-client>=2.0.0"
     ],
     classifiers=[
         "Programming Language :: Python :: 3",
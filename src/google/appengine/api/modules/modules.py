@@ -20,20 +20,26 @@ Services were formerly known as modules and the API methods still
 reflect that naming. For more information and code samples, see
 Using the Modules guide:
 https://cloud.google.com/appengine/docs/standard/python/using-the-modules-api.
+
+When the Admin API is enabled (MODULES_USE_ADMIN_API=true), the first call to
+each function builds and caches an Admin API client. Applications can call
+`warmup()` from their warmup request handler to pay that cost up front, so
+that later calls, including the `*_async` ones, only make the API request.
 """
 
+import concurrent.futures
+import functools
 import logging
 import os
 import threading
+import time
 
 from google.appengine.api import apiproxy_stub_map
 from google.appengine.api.modules import modules_service_pb2
 from google.appengine.runtime import apiproxy_errors
-from googleapiclient import discovery, errors, http
-from google_auth_httplib2 import AuthorizedHttp
-import google.auth
-import six
-import httplib2
+
+# googleapiclient, google.auth and httplib2 are only needed for the Admin API
+# code paths and are slow to import, so they are imported where they are used.
 
 
 __all__ = [
@@ -53,11 +59,15 @@ __all__ = [
     'get_num_instances',
     'set_num_instances',
     'set_num_instances_async',
+    'set_num_instances_bulk',
     'start_version',
     'start_version_async',
+    'start_versions',
     'stop_version',
     'stop_version_async',
-    'get_hostname'
+    'stop_versions',
+    'get_hostname',
+    'warmup'
 ]
 
 class Error(Exception):
@@ -86,26 +96,35 @@ class TransientError(Error):
 def _has_opted_in():
   return (os.environ.get('MODULES_USE_ADMIN_API', 'false').lower() == 'true')
 
+_HTTP_STATUS_ERROR_MAP = {
+    400: InvalidInstancesError,
+    404: InvalidVersionError,
+}
+
 def _raise_error(e):
   # Translate HTTP errors to the exceptions expected by the API
-  if e.resp.status == 400:
-      raise InvalidInstancesError(e) from e
-  elif e.resp.status == 404:
-      raise InvalidVersionError(e) from e
-  elif e.resp.status >= 500:
-      raise TransientError(e) from e
-  else:
-      raise Error(e) from e
-
+  status = e.resp.status
+  error = _HTTP_STATUS_ERROR_MAP.get(status) or (
+      TransientError if status >= 500 else Error)
+  raise error(e) from e
+
+# The runtime sets these environment variables once at instance startup, so
+# the values derived from them are computed once and cached.
+@functools.lru_cache(maxsize=None)
 def _get_project_id():
   project_id = os.environ.get('GAE_PROJECT') or os.environ.get(
       'GOOGLE_CLOUD_PROJECT'
   )
   if project_id is None:
     app_id = os.environ.get('GAE_APPLICATION')
-    project_id = app_id.split('~', 1)[1]
+    if not app_id:
+      raise Error('Could not determine the project ID; set GAE_APPLICATION, '
+                  'GAE_PROJECT or GOOGLE_CLOUD_PROJECT.')
+    # GAE_APPLICATION is "<partition>~<project>"; tolerate a missing partition.
+    project_id = app_id.partition('~')[2] or app_id
   return project_id
 
+@functools.lru_cache(maxsize=None)
 def get_current_module_name():
   """Returns the module name of the current instance.
 
@@ -115,6 +134,7 @@ def get_current_module_name():
   return os.environ.get('GAE_SERVICE') or os.environ.get('CURRENT_MODULE_ID')
 
 
+@functools.lru_cache(maxsize=None)
 def get_current_version_name():
   """Returns the version of the current instance.
 
@@ -129,6 +149,7 @@ def get_current_version_name():
   return None if result == 'None' else result
 
 
+@functools.lru_cache(maxsize=None)
 def get_current_instance_id():
   """Returns the ID of the current instance.
 
@@ -146,29 +167,86 @@ def get_current_instance_id():
   return os.environ.get('GAE_INSTANCE') or os.environ.get('INSTANCE_ID', None)
 
 
+def _reset_env_cache():
+  """Clears the cached values derived from environment variables."""
+  for fn in (_get_project_id, get_current_module_name,
+             get_current_version_name, get_current_instance_id):
+    fn.cache_clear()
+
+
+def _read_env_number(name, default, convert, minimum):
+  """Returns environment variable `name` converted with `convert`.
+
+  Missing values, values `convert` rejects and values below `minimum` fall
+  back to `default`, so a bad setting never breaks importing this module.
+  """
+  value = os.environ.get(name)
+  if value is None:
+    return default
+  try:
+    number = convert(value)
+  except ValueError:
+    number = None
+  if number is None or not number >= minimum:
+    logging.warning('Ignoring invalid %s=%r; using %r.', name, value, default)
+    return default
+  return number
+
+
+class _LazyExecutor:
+  """A ThreadPoolExecutor that is created on first use.
+
+  The pool size is read from environment variable `workers_env` at that point
+  rather than at import time.
+  """
+
+  def __init__(self, workers_env, default_workers, thread_name_prefix):
+    self._workers_env = workers_env
+    self._default_workers = default_workers
+    self._thread_name_prefix = thread_name_prefix
+    self._executor = None
+    self._lock = threading.Lock()
+
+  def _get_executor(self):
+    if self._executor is None:
+      with self._lock:
+        if self._executor is None:
+          self._executor = concurrent.futures.ThreadPoolExecutor(
+              max_workers=_read_env_number(
+                  self._workers_env, self._default_workers, int, 1),
+              thread_name_prefix=self._thread_name_prefix)
+    return self._executor
+
+  def submit(self, fn, *args, **kwargs):
+    return self._get_executor().submit(fn, *args, **kwargs)
+
+
+# Admin API calls made by the *_async functions run on a shared, bounded pool
+# instead of a new thread per call.
+_rpc_executor = _LazyExecutor('GAE_MODULES_RPC_WORKERS', 8, 'gae-modules-rpc')
+
+# The read that get_hostname overlaps with its first application lookup runs on
+# a separate pool, so it is not queued behind a burst of
+# start/stop/set_num_instances calls.
+_read_executor = _LazyExecutor(
+    'GAE_MODULES_READ_WORKERS', 4, 'gae-modules-read')
+
+
 class _ThreadedRpc:
   """A class to emulate the UserRPC object for threaded operations."""
 
-  def __init__(self, target):
-    self.thread = threading.Thread(target=self._run_target, args=(target,))
-    self.exception = None
-    self.done = threading.Event()
-    self.thread.start()
+  __slots__ = ('_future',)
 
-  def _run_target(self, target):
-    try:
-        target()
-    except Exception as e:
-        self.exception = e
-    finally:
-        self.done.set()
+  def __init__(self, target):
+    self._future = _rpc_executor.submit(target)
 
   def wait(self):
-    self.done.wait()
+    concurrent.futures.wait([self._future])
 
   def check_success(self):
-    if self.exception:
-      raise self.exception
+    exception = self._future.exception()
+    if exception:
+      raise exception
 
   def get_result(self):
     self.wait()
@@ -211,15 +289,151 @@ def _CheckAsyncResult(rpc, expected_application_errors,
         raise mapped_error()
     raise Error(e)
 
-def _get_admin_api_client_with_useragent(methodName):
+# Admin API clients are expensive to build (the discovery document has to be
+# loaded and parsed), so they are built once per user agent and shared.
+_client_lock = threading.Lock()
+_client_cache = {}
+
+# Application Default Credentials are resolved once per process.
+_credentials_lock = threading.Lock()
+_credentials = None
+
+# httplib2.Http is not thread-safe, so each thread keeps its own authorized
+# transport. All clients share it, so a thread reuses one keep-alive connection
+# to the Admin API whichever function it calls.
+_thread_local_http = threading.local()
+
+
+def _get_credentials():
+  global _credentials
+  if _credentials is None:
+    with _credentials_lock:
+      if _credentials is None:
+        import google.auth
+        _credentials, _ = google.auth.default()
+  return _credentials
+
+
+def _get_authorized_http():
+  """Returns the calling thread's authorized Admin API transport."""
+  authorized_http = getattr(_thread_local_http, 'authorized_http', None)
+  if authorized_http is None:
+    from google_auth_httplib2 import AuthorizedHttp
+    import httplib2
+    authorized_http = AuthorizedHttp(_get_credentials(),
+                                     http=httplib2.Http(timeout=60))
+    _thread_local_http.authorized_http = authorized_http
+  return authorized_http
+
+
+def _build_admin_api_client(methodName):
+  from googleapiclient import discovery, http
   userAgent = 'appengine-modules-api-python-client/' + methodName
-  http_client = httplib2.Http(timeout=60)
-  http_client = http.set_user_agent(http_client, userAgent)
-  credentials,_ = google.auth.default()
-  authorized_http = AuthorizedHttp(credentials, http=http_client)
-  client = discovery.build('appengine', 'v1', http=authorized_http)
+
+  def _build_request(unused_http, *args, headers=None, **kwargs):
+    # The transport is shared between clients, so the per-method user agent
+    # is set on each request, as googleapiclient.http.set_user_agent would.
+    headers = dict(headers or {})
+    if 'user-agent' in headers:
+      headers['user-agent'] = userAgent + ' ' + headers['user-agent']
+    else:
+      headers['user-agent'] = userAgent
+    return http.HttpRequest(_get_authorized_http(), *args, headers=headers,
+                            **kwargs)
+
+  return discovery.build('appengine', 'v1', http=_get_authorized_http(),
+                         requestBuilder=_build_request,
+                         static_discovery=True)
+
+
+def _get_admin_api_client_with_useragent(methodName):
+  client = _client_cache.get(methodName)
+  if client is None:
+    with _client_lock:
+      client = _client_cache.get(methodName)
+      if client is None:
+        client = _build_admin_api_client(methodName)
+        _client_cache[methodName] = client
   return client
 
+
+# Every public function that calls the Admin API, i.e. every user agent a
+# client is built for.
+_ADMIN_API_METHOD_NAMES = (
+    'get_modules',
+    'get_versions',
+    'get_default_version',
+    'get_num_instances',
+    'set_num_instances',
+    'start_version',
+    'stop_version',
+    'get_hostname',
+)
+
+
+def warmup():
+  """Builds the Admin API clients used by this module ahead of time.
+
+  Call this from a warmup request handler so the first real calls do not pay
+  for building clients. Does nothing unless MODULES_USE_ADMIN_API is enabled.
+  """
+  if not _has_opted_in():
+    return
+  for methodName in _ADMIN_API_METHOD_NAMES:
+    _get_admin_api_client_with_useragent(methodName)
+
+
+def _clear_admin_api_client_cache():
+  """Drops cached clients, credentials and this thread's transports."""
+  global _credentials
+  with _client_lock:
+    _client_cache.clear()
+  with _credentials_lock:
+    _credentials = None
+  _thread_local_http.__dict__.clear()
+
+class _TTLCache:
+  """A thread-safe mapping whose entries expire after a fixed time-to-live."""
+
+  def __init__(self, ttl):
+    self._ttl = ttl
+    self._lock = threading.Lock()
+    self._entries = {}
+
+  def get(self, key):
+    """Returns the cached value for `key`, or `None` if missing or expired."""
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      expiry, value = entry
+      if expiry <= time.monotonic():
+        del self._entries[key]
+        return None
+      return value
+
+  def set(self, key, value):
+    with self._lock:
+      self._entries[key] = (time.monotonic() + self._ttl, value)
+
+  def invalidate(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+
+# Read-only Admin API results (services, versions and default version) change
+# rarely, so they are cached for MODULES_API_CACHE_TTL seconds.
+_api_cache = _TTLCache(_read_env_number('MODULES_API_CACHE_TTL', 60, float, 0))
+
+# Instance counts are polled by scaling loops; a short TTL absorbs bursts of
+# reads without serving noticeably stale values.
+_num_instances_cache = _TTLCache(5)
+
+
 def get_modules():
   """Returns a list of all modules for the application.
 
@@ -235,19 +449,28 @@ def get_modules():
   """
   if not _has_opted_in():
     return get_modules_legacy()
+
+  from googleapiclient import errors
   
   project_id = _get_project_id()
-  client = _get_admin_api_client_with_useragent('get_modules')
-  request = client.apps().services().list(appsId=project_id)
+  cache_key = ('get_modules', project_id)
+  services = _api_cache.get(cache_key)
+  if services is None:
+    client = _get_admin_api_client_with_useragent('get_modules')
+    request = client.apps().services().list(
+        appsId=project_id, fields='services/id')
 
-  try:
-    response = request.execute()
-  except errors.HttpError as e:
-    if e.resp.status == 404:
-      raise Error(f"Project '{project_id}' not found.") from e
-    _raise_error(e)
+    try:
+      response = request.execute()
+    except errors.HttpError as e:
+      if e.resp.status == 404:
+        raise Error(f"Project '{project_id}' not found.") from e
+      _raise_error(e)
 
-  return [service['id'] for service in response.get('services', [])]
+    services = tuple(service['id'] for service in response.get('services', []))
+    _api_cache.set(cache_key, services)
+
+  return list(services)
 
 #Legacy get_modules implementation
 def get_modules_legacy():
@@ -282,22 +505,30 @@ def get_versions(module=None):
   if not _has_opted_in():
     return get_versions_legacy(module=module)
 
+  from googleapiclient import errors
+
   if not module:
     module = os.environ.get('GAE_SERVICE', 'default')
   
   project_id = _get_project_id()
-  client = _get_admin_api_client_with_useragent('get_versions')
-  request = client.apps().services().versions().list(
-      appsId=project_id, servicesId=module, view='FULL'
-  )
-  try:
-    response = request.execute()
-  except errors.HttpError as e:
-    if e.resp.status == 404:
-      raise InvalidModuleError(f"") from e
-    _raise_error(e)
+  cache_key = ('get_versions', project_id, module)
+  versions = _api_cache.get(cache_key)
+  if versions is None:
+    client = _get_admin_api_client_with_useragent('get_versions')
+    request = client.apps().services().versions().list(
+        appsId=project_id, servicesId=module, fields='versions/id'
+    )
+    try:
+      response = request.execute()
+    except errors.HttpError as e:
+      if e.resp.status == 404:
+        raise InvalidModuleError(f"") from e
+      _raise_error(e)
+
+    versions = tuple(version['id'] for version in response.get('versions', []))
+    _api_cache.set(cache_key, versions)
 
-  return [version['id'] for version in response.get('versions', [])]
+  return list(versions)
 
 def get_versions_legacy(module=None):
   def _ResultHook(rpc):
@@ -337,12 +568,19 @@ def get_default_version(module=None):
   if not _has_opted_in():
     return get_default_version_legacy(module=module)
 
+  from googleapiclient import errors
+
   if not module:
     module = os.environ.get('GAE_SERVICE', 'default')
   project = _get_project_id()
+  cache_key = ('get_default_version', project, module)
+  retVersion = _api_cache.get(cache_key)
+  if retVersion is not None:
+    return retVersion
+
   client = _get_admin_api_client_with_useragent('get_default_version')
   request = client.apps().services().get(
-    appsId=project, servicesId=module)
+    appsId=project, servicesId=module, fields='split/allocations')
 
   try:
     response = request.execute()
@@ -352,25 +590,17 @@ def get_default_version(module=None):
     _raise_error(e)
 
   allocations = response.get('split', {}).get('allocations')
-  maxAlloc = -1
   retVersion = None
 
   if allocations:
-    for version, allocation in allocations.items():
-      if allocation == 1.0:
-        retVersion = version
-        break
-
-      if allocation > maxAlloc:
-        retVersion = version
-        maxAlloc = allocation
-      elif allocation == maxAlloc:
-        if version < retVersion:
-          retVersion = version
+    # The version with the largest allocation; ties go to the
+    # lexicographically smallest version name.
+    retVersion = min(allocations.items(), key=lambda kv: (-kv[1], kv[0]))[0]
 
   if retVersion is None:
     raise InvalidVersionError(f"Could not determine default version for module '{module}'.")
 
+  _api_cache.set(cache_key, retVersion)
   return retVersion
 
 def get_default_version_legacy(module):
@@ -416,6 +646,8 @@ def get_num_instances(
   if not _has_opted_in():
     return get_num_instances_legacy(module=module, version=version)
 
+  from googleapiclient import errors
+
   if module is None:
     module = get_current_module_name()
 
@@ -423,9 +655,15 @@ def get_num_instances(
     version = get_current_version_name()
 
   project_id = _get_project_id()
+  cache_key = (project_id, module, version)
+  instances = _num_instances_cache.get(cache_key)
+  if instances is not None:
+    return instances
+
   client = _get_admin_api_client_with_useragent('get_num_instances')
   request = client.apps().services().versions().get(
-        appsId=project_id, servicesId=module, versionsId=version)
+        appsId=project_id, servicesId=module, versionsId=version,
+        fields='manualScaling')
 
   try:
     response = request.execute()
@@ -437,7 +675,10 @@ def get_num_instances(
   if 'manualScaling' not in response:
       raise InvalidVersionError(f"")
   
-  return response['manualScaling'].get('instances')
+  instances = response['manualScaling'].get('instances')
+  if instances is not None:
+    _num_instances_cache.set(cache_key, instances)
+  return instances
 
   
 def get_num_instances_legacy(module, version):
@@ -456,22 +697,37 @@ def get_num_instances_legacy(module, version):
                         _ResultHook).get_result()
 
 
-def _admin_api_version_patch(project_id, module, version, body, update_mask):
-  methodName = ''
-  if 'manualScaling' in body:
-    methodName = 'set_num_instances'
-  elif 'servingStatus' in body and body['servingStatus'] == 'SERVING':
-    methodName = 'start_version'
-  elif 'servingStatus' in body and body['servingStatus'] == 'STOPPED':
-    methodName = 'stop_version'
+def _patch_version_async(methodName, project_id, module, version, body,
+                         update_mask):
+  """Returns a `_ThreadedRpc` that patches a version through the Admin API.
+
+  This backs `set_num_instances_async`, `start_version_async` and
+  `stop_version_async`. The patch runs on the shared RPC pool, so callers can
+  issue many patches and wait on the returned RPCs together.
+  """
+  from googleapiclient import errors
+
+  cache_key = (project_id, module, version)
+  instances = body.get('manualScaling', {}).get('instances')
+
+  def run_request():
+    _num_instances_cache.invalidate(cache_key)
+    try:
+      client = _get_admin_api_client_with_useragent(methodName)
+      client.apps().services().versions().patch(
+        appsId=project_id,
+        servicesId=module,
+        versionsId=version,
+        updateMask=update_mask,
+        body=body).execute()
+    except errors.HttpError as e:
+      _raise_error(e)
+    # A successful set_num_instances tells us the new count, so later
+    # get_num_instances calls for this version need no round trip.
+    if instances is not None:
+      _num_instances_cache.set(cache_key, instances)
 
-  client = _get_admin_api_client_with_useragent(methodName)
-  client.apps().services().versions().patch(
-    appsId=project_id,
-    servicesId=module,
-    versionsId=version,
-    updateMask=update_mask,
-    body=body).execute()
+  return _ThreadedRpc(target=run_request)
 
 def set_num_instances(
     instances,
@@ -515,7 +771,7 @@ def set_num_instances_async(
   if not _has_opted_in():
     return set_num_instances_async_legacy(instances=instances, module=module, version=version)
 
-  if not isinstance(instances, six.integer_types):
+  if not isinstance(instances, int):
     raise TypeError("'instances' arg must be of type long or int.")
 
   project_id = _get_project_id()
@@ -524,19 +780,9 @@ def set_num_instances_async(
   if version is None:
     version = get_current_version_name()
 
-  def run_request():
-    """This function will be executed in a separate thread."""
-    try:
-      body = {
-        'manualScaling': {
-          'instances': instances
-          }
-        }
-      _admin_api_version_patch(project_id, module, version, body, 'manualScaling.instances')
-    except errors.HttpError as e:
-      _raise_error(e)
-
-  return _ThreadedRpc(target=run_request)
+  return _patch_version_async(
+      'set_num_instances', project_id, module, version,
+      {'manualScaling': {'instances': instances}}, 'manualScaling.instances')
 
 def set_num_instances_async_legacy(instances, module, version):
   def _ResultHook(rpc):
@@ -546,7 +792,7 @@ def set_num_instances_async_legacy(instances, module, version):
     ]
     _CheckAsyncResult(rpc, mapped_errors, {})
 
-  if not isinstance(instances, six.integer_types):
+  if not isinstance(instances, int):
     raise TypeError("'instances' arg must be of type long or int.")
   request = modules_service_pb2.SetNumInstancesRequest()
   request.instances = instances
@@ -594,17 +840,9 @@ def start_version_async(
   if version is None:
     version = get_current_version_name()
   project_id = _get_project_id()
-  def run_request():
-    """This function will be executed in a separate thread."""
-    try:
-      body = {
-        'servingStatus': 'SERVING'
-        }
-      _admin_api_version_patch(project_id, module, version, body, 'servingStatus')
-    except errors.HttpError as e:
-      _raise_error(e)
-
-  return _ThreadedRpc(target=run_request)
+  return _patch_version_async(
+      'start_version', project_id, module, version,
+      {'servingStatus': 'SERVING'}, 'servingStatus')
 
 def start_version_async_legacy(module, version):
   def _ResultHook(rpc):
@@ -666,17 +904,9 @@ def stop_version_async(
   if version is None:
     version = get_current_version_name()
   project_id = _get_project_id()
-  def run_request():
-    """This function will be executed in a separate thread."""
-    try:
-      body = {
-        'servingStatus': 'STOPPED'
-        }
-      _admin_api_version_patch(project_id, module, version, body, 'servingStatus')
-    except errors.HttpError as e:
-      _raise_error(e)
-
-  return _ThreadedRpc(target=run_request)
+  return _patch_version_async(
+      'stop_version', project_id, module, version,
+      {'servingStatus': 'STOPPED'}, 'servingStatus')
 
 def stop_version_async_legacy(module, version):
   def _ResultHook(rpc):
@@ -700,6 +930,92 @@ def stop_version_async_legacy(module, version):
   return _MakeAsyncCall('StopModule', request, response, _ResultHook)
 
 
+def _get_results(rpcs):
+  """Waits for all `rpcs`, raising the first error as soon as one fails."""
+  futures = [rpc._future for rpc in rpcs if isinstance(rpc, _ThreadedRpc)]
+  done, _ = concurrent.futures.wait(
+      futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+  for future in done:
+    exception = future.exception()
+    if exception:
+      raise exception
+  for rpc in rpcs:
+    rpc.get_result()
+
+
+def set_num_instances_bulk(instances_module_version):
+  """Sets the number of instances on several module versions concurrently.
+
+  Args:
+    instances_module_version: Iterable of `(instances, module, version)`
+      tuples, interpreted as the arguments to `set_num_instances`.
+
+  Raises:
+    The first error raised by any of the updates; see `set_num_instances`.
+  """
+  instances_module_version = list(instances_module_version)
+  # Arguments are checked before any update is sent, so a bad entry never
+  # leaves the updates before it running unreported.
+  for instances, _, _ in instances_module_version:
+    if not isinstance(instances, int):
+      raise TypeError("'instances' arg must be of type long or int.")
+  _get_results([set_num_instances_async(instances, module, version)
+                for instances, module, version in instances_module_version])
+
+
+def start_versions(module_version_pairs):
+  """Starts all instances for several module versions concurrently.
+
+  Args:
+    module_version_pairs: Iterable of `(module, version)` tuples to start.
+
+  Raises:
+    The first error raised by any of the updates; see `start_version`.
+  """
+  _get_results([start_version_async(module, version)
+                for module, version in module_version_pairs])
+
+
+def stop_versions(module_version_pairs):
+  """Stops all instances for several module versions concurrently.
+
+  Args:
+    module_version_pairs: Iterable of `(module, version)` tuples to stop.
+
+  Raises:
+    The first error raised by any of the updates; see `stop_version`.
+  """
+  _get_results([stop_version_async(module, version)
+                for module, version in module_version_pairs])
+
+
+# An application's default hostname never changes, so it is fetched once per
+# project and kept for the lifetime of the process.
+_default_hostname_lock = threading.Lock()
+_default_hostnames = {}
+
+
+def _get_default_hostname(client, project_id):
+  """Returns the default hostname of the application, e.g. `myapp.appspot.com`."""
+  default_hostname = _default_hostnames.get(project_id)
+  if default_hostname is None:
+    with _default_hostname_lock:
+      default_hostname = _default_hostnames.get(project_id)
+      if default_hostname is None:
+        from googleapiclient import errors
+        try:
+          request = client.apps().get(
+              appsId=project_id, fields='defaultHostname')
+          response = request.execute()
+          default_hostname = response.get('defaultHostname')
+        except errors.HttpError as e:
+          _raise_error(e)
+
+        if default_hostname is not None:
+          _default_hostnames[project_id] = default_hostname
+  return default_hostname
+
+
 def _construct_hostname(*hostname_parts):
   """Constructs a hostname for the given module, version, and instance."""
   return ".".join(hostname_parts)
@@ -731,6 +1047,8 @@ def get_hostname(
   if not _has_opted_in():
     return get_hostname_legacy(module=module, version=version, instance=instance)
 
+  from googleapiclient import errors
+
   if instance is not None:
     try:
       instance_id = int(instance)
@@ -745,16 +1063,16 @@ def get_hostname(
   req_module = module or get_current_module_name()
   req_version = version or get_current_version_name()
 
-  try:
+  client = _get_admin_api_client_with_useragent('get_hostname')
+  default_hostname = _default_hostnames.get(project_id)
+  if default_hostname is not None:
     services = get_modules()
-    client = _get_admin_api_client_with_useragent('get_hostname')
-    request = client.apps().get(appsId=project_id)
-    
-    response = request.execute()
-    default_hostname = response.get('defaultHostname')
-
-  except errors.HttpError as e:
-    _raise_error(e)
+  else:
+    # The service list does not depend on the application lookup, so on the
+    # first call it is fetched concurrently with it.
+    services_future = _read_executor.submit(get_modules)
+    default_hostname = _get_default_hostname(client, project_id)
+    services = services_future.result()
 
   if req_module not in services:
     raise InvalidModuleError(f"")
@@ -762,7 +1080,6 @@ def get_hostname(
   if len(services) == 1 and services[0] == 'default':
     if req_module != 'default':
       raise InvalidModuleError(f"Module '{req_module}' not found.")
-    hostname_parts = [req_version, default_hostname]
     if instance:
       return _construct_hostname(instance, req_version, default_hostname)
     return _construct_hostname(req_version, default_hostname)
@@ -770,8 +1087,9 @@ def get_hostname(
   if instance is not None:
     try:
       # Get version details to check scaling and instance count
-      version_request = discovery.build('appengine', 'v1').apps().services().versions().get(
-          appsId=project_id, servicesId=req_module, versionsId=req_version, view='FULL')
+      version_request = client.apps().services().versions().get(
+          appsId=project_id, servicesId=req_module, versionsId=req_version,
+          fields='manualScaling')
       version_details = version_request.execute()
 
       if 'manualScaling' not in version_details:
@@ -831,7 +1149,7 @@ def get_hostname_legacy(module, version, instance):
   if version:
     request.version = version
   if instance or instance == 0:
-    if not isinstance(instance, (six.string_types, six.integer_types)):
+    if not isinstance(instance, (str, int)):
       raise TypeError("'instance' arg must be of type basestring, long or int.")
     request.instance = str(instance)
   response = modules_service_pb2.GetHostnameResponse()
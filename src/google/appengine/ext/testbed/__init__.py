@@ -130,6 +130,7 @@ from google.appengine.api.blobstore import dict_blob_storage
 from google.appengine.api.capabilities import capability_stub
 from google.appengine.api.images import images_stub
 from google.appengine.api.memcache import memcache_stub
+from google.appengine.api.modules import modules
 from google.appengine.api.modules import modules_stub
 from google.appengine.api.namespace_manager import namespace_manager
 from google.appengine.api.oauth import oauth_api
@@ -425,6 +426,7 @@ class Testbed(object):
 
     os.environ.clear()
     os.environ.update(self._orig_env)
+    modules._reset_env_cache()
 
     all_reset_tokens = {
         **self._context_reset_tokens,
@@ -542,6 +544,7 @@ class Testbed(object):
                       if key in gae_vars
                       else key)
           self.setup_wsgi_env(**{wsgi_key: value})
+    modules._reset_env_cache()
 
 
 
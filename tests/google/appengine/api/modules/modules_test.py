@@ -16,8 +16,13 @@
 #
 """Tests for google.appengine.api.modules."""
 
+import functools
+import json
 import logging
 import os
+import re
+import threading
+import types
 
 import google
 
@@ -28,149 +33,429 @@ from google.appengine.runtime.context import ctx_test_util
 import google.auth
 import google_auth_httplib2
 from googleapiclient import discovery
-import mox
+from googleapiclient import discovery_cache
+from googleapiclient import http as googleapiclient_http
+import mock
 
 from absl.testing import absltest
+from absl.testing import parameterized
 from googleapiclient import errors
 
 
+# Admin API resources in the order they are reached from the client.
+_RESOURCE_CHAIN = ('apps', 'services', 'versions')
+
+# Expected error messages, matched literally.
+_PROJECT_NOT_FOUND = re.compile(re.escape("Project 'project' not found."))
+_NOT_MANUALLY_SCALED = re.compile(re.escape(
+    'Instance-specific hostnames are only available for manually scaled '
+    'services.'))
+_NO_SUCH_INSTANCE = re.compile(re.escape(
+    'The specified instance does not exist for this module/version.'))
+_INSTANCE_NOT_AN_INTEGER = re.compile(re.escape(
+    'Instance must be a non-negative integer.'))
+
+# Request bodies sent by start_version and stop_version.
+_SERVING = types.MappingProxyType({'servingStatus': 'SERVING'})
+_STOPPED = types.MappingProxyType({'servingStatus': 'STOPPED'})
+
+
+def _Chain(parent, *names):
+  """Returns the mock that parent.name1().name2()... evaluates to.
+
+  Calls are not recorded on the way down, so tests only need to check the
+  terminal request method.
+  """
+  for name in names:
+    parent = getattr(parent, name).return_value
+  return parent
+
+
+class _FakeResp(object):
+  """The minimal response object that errors.HttpError reads."""
+
+  __slots__ = ('status', 'reason')
+
+  def __init__(self, status, reason='Error'):
+    self.status = status
+    self.reason = reason
+
+
+@functools.lru_cache(maxsize=None)
+def _DiscoveryDocument():
+  """Returns the appengine v1 discovery document bundled with googleapiclient.
+
+  This is the document discovery.build reads with static_discovery=True, so
+  no test needs a network fetch to build a real client.
+  """
+  return discovery_cache.get_static_doc('appengine', 'v1')
+
+
+# The unpatched discovery.build, for tests of the real client build path.
+_real_build = discovery.build
+
+# Any test that builds a real client without calling _SetupAdminApiMocks
+# fails loudly instead of reaching the network.
+_build_patcher = mock.patch.object(
+    discovery, 'build',
+    side_effect=AssertionError('discovery.build called unexpectedly'))
+
+
+def setUpModule():
+  _build_patcher.start()
+
+
+def tearDownModule():
+  _build_patcher.stop()
+
+
 @ctx_test_util.isolated_context()
-class ModulesTest(absltest.TestCase):
+class ModulesTest(parameterized.TestCase):
+
+  # Environment variables set before every test; os.environ is restored to
+  # its previous contents after each test.
+  _DEFAULT_ENVIRON = {
+      'GAE_APPLICATION': 's~project',
+      'GOOGLE_CLOUD_PROJECT': 'project',
+      'GAE_SERVICE': 'default',
+      'GAE_VERSION': 'v1',
+      'CURRENT_MODULE_ID': 'default',
+      'CURRENT_VERSION_ID': 'v1.123',
+  }
+
+  # Opaque client that _SetupAdminApiMocks makes discovery.build return.
+  mock_admin_api_client = mock.sentinel.admin_api_client
 
   def setUp(self):
     """Setup testing environment."""
-    self.mox = mox.Mox()
-    self.mock_admin_api_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, 'discovery')
-
-    # Environment variables are cleared in tearDown
-    os.environ['GAE_APPLICATION'] = 's~project'
-    os.environ['GOOGLE_CLOUD_PROJECT'] = 'project'
-    os.environ['GAE_SERVICE'] = 'default'
-    os.environ['GAE_VERSION'] = 'v1'
-    os.environ['CURRENT_MODULE_ID'] = 'default'
-    os.environ['CURRENT_VERSION_ID'] = 'v1.123'
+    self.enter_context(mock.patch.dict(os.environ, self._DEFAULT_ENVIRON))
+    self._ResetModuleCaches()
 
   def tearDown(self):
     """Tear down testing environment."""
-    self.mox.UnsetStubs()
-    self.mox.VerifyAll()
-
-    # Clear environment variables that were set in tests
-    for var in [
-        'GAE_SERVICE', 'GAE_VERSION', 'CURRENT_MODULE_ID', 'CURRENT_VERSION_ID',
-        'INSTANCE_ID', 'GAE_INSTANCE', 'GOOGLE_CLOUD_PROJECT', 'GAE_APPLICATION'
-    ]:
-      if var in os.environ:
-        del os.environ[var]
-
-  def _SetupAdminApiMocks(self, project='project'):
-    modules.discovery.build('appengine',
-                            'v1').AndReturn(self.mock_admin_api_client)
+    self._ResetModuleCaches()
+
+  def _ResetModuleCaches(self):
+    modules._reset_env_cache()
+    modules._api_cache.clear()
+    modules._num_instances_cache.clear()
+    modules._default_hostnames.clear()
+
+  def _SetupAdminApiMocks(self, client=None):
+    """Makes discovery.build return `client`; returns the build mock.
+
+    Only tests that build an Admin API client pay for these patches, and
+    calling this again within a test just changes the returned client.
+    """
+    if not getattr(self, '_discovery_stubbed', False):
+      # Only these tests can populate the client and credentials caches.
+      self.addCleanup(modules._clear_admin_api_client_cache)
+      self.enter_context(mock.patch.object(
+          google.auth, 'default', return_value=(None, 'project')))
+      self._build = self.enter_context(mock.patch.object(discovery, 'build'))
+      self._discovery_stubbed = True
+    self._build.return_value = client or self.mock_admin_api_client
+    return self._build
+
+  def _UseAdminApi(self):
+    """Opts into the Admin API for the rest of the test."""
+    self.enter_context(
+        mock.patch.dict(os.environ, {'MODULES_USE_ADMIN_API': 'true'}))
+
+  def _PatchAdminApiClient(self):
+    """Patches the Admin API client getter; returns the getter mock."""
+    return self.enter_context(
+        mock.patch.object(modules, '_get_admin_api_client_with_useragent'))
+
+  def _PatchAdminApi(self, level):
+    """Patches the Admin API client getter and walks the resource chain.
+
+    Args:
+      level: 'apps', 'services' or 'versions'.
+
+    Returns:
+      A (getter, resource) tuple, where resource is the mock returned by
+      client.apps(), client.apps().services() or
+      client.apps().services().versions() respectively.
+    """
+    get_client = self._PatchAdminApiClient()
+    depth = _RESOURCE_CHAIN.index(level) + 1
+    return get_client, _Chain(get_client.return_value,
+                              *_RESOURCE_CHAIN[:depth])
+
+  def _CallReadApi(self, func, level, request, outcome, expected_kwargs,
+                   **func_kwargs):
+    """Calls a read-only modules function against a mocked Admin API request.
+
+    Args:
+      func: The modules function to call; its name is also the method name
+        the Admin API client is expected to be fetched with.
+      level: The resource issuing the request; see _PatchAdminApi.
+      request: The request method on that resource, e.g. 'list' or 'get'.
+      outcome: The value execute() returns, or an exception for it to raise.
+      expected_kwargs: The arguments the request method must be called with.
+      **func_kwargs: Keyword arguments for func.
+
+    Returns:
+      The result of func.
+    """
+    get_client, resource = self._PatchAdminApi(level)
+    request_method = getattr(resource, request)
+    if isinstance(outcome, Exception):
+      request_method.return_value.execute.side_effect = outcome
+    else:
+      request_method.return_value.execute.return_value = outcome
+    try:
+      return func(**func_kwargs)
+    finally:
+      get_client.assert_called_once_with(func.__name__)
+      request_method.assert_called_once_with(**expected_kwargs)
+
+  def _UseDiscoveryClient(self, responses):
+    """Serves Admin API calls from a client built from the discovery document.
+
+    Args:
+      responses: A list of (headers, content) pairs, one per HTTP request.
+
+    Returns:
+      The HttpMockSequence transport, whose request_sequence records every
+      (uri, method, body, headers) sent.
+    """
+    http = googleapiclient_http.HttpMockSequence(responses)
+    client = discovery.build_from_document(_DiscoveryDocument(), http=http)
+    self._PatchAdminApiClient().return_value = client
+    return http
 
   def _CreateHttpError(self, status, reason='Error'):
-    resp = self.mox.CreateMockAnything()
-    resp.status = status
-    resp.reason = reason
-    return errors.HttpError(resp, b'')
+    return errors.HttpError(_FakeResp(status, reason), b'')
 
   # --- Tests for Get/Set Current Module, Version, Instance ---
 
-  def testGetCurrentModuleName(self):
+  @parameterized.named_parameters(
+      ('ModuleName', {'GAE_SERVICE': 'module1'},
+       modules.get_current_module_name, 'module1'),
+      ('ModuleName_Fallback', {'CURRENT_MODULE_ID': 'module2'},
+       modules.get_current_module_name, 'module2'),
+      ('VersionName', {'GAE_VERSION': 'v2'},
+       modules.get_current_version_name, 'v2'),
+      ('VersionName_Fallback', {'CURRENT_VERSION_ID': 'v3.456'},
+       modules.get_current_version_name, 'v3'),
+      ('VersionName_None', {'CURRENT_VERSION_ID': 'None.456'},
+       modules.get_current_version_name, None),
+      ('InstanceId', {'GAE_INSTANCE': 'instance1'},
+       modules.get_current_instance_id, 'instance1'),
+      ('InstanceId_Fallback', {'INSTANCE_ID': 'instance2'},
+       modules.get_current_instance_id, 'instance2'),
+      ('InstanceId_None', {}, modules.get_current_instance_id, None),
+  )
+  def testGetCurrent(self, environ, getter, expected):
+    self.enter_context(mock.patch.dict(os.environ, environ, clear=True))
+    self.assertEqual(expected, getter())
+
+  def testGetCurrentModuleName_Cached(self):
+    self.assertEqual('default', modules.get_current_module_name())
     os.environ['GAE_SERVICE'] = 'module1'
+    self.assertEqual('default', modules.get_current_module_name())
+    modules._reset_env_cache()
     self.assertEqual('module1', modules.get_current_module_name())
 
-  def testGetCurrentModuleName_Fallback(self):
-    if 'GAE_SERVICE' in os.environ:
-      del os.environ['GAE_SERVICE']
-    os.environ['CURRENT_MODULE_ID'] = 'module2'
-    self.assertEqual('module2', modules.get_current_module_name())
-
-  def testGetCurrentVersionName(self):
-    os.environ['GAE_VERSION'] = 'v2'
-    self.assertEqual('v2', modules.get_current_version_name())
-
-  def testGetCurrentVersionName_Fallback(self):
-    if 'GAE_VERSION' in os.environ:
-      del os.environ['GAE_VERSION']
-    os.environ['CURRENT_VERSION_ID'] = 'v3.456'
-    self.assertEqual('v3', modules.get_current_version_name())
-
-  def testGetCurrentVersionName_None(self):
-    if 'GAE_VERSION' in os.environ:
-      del os.environ['GAE_VERSION']
-    os.environ['CURRENT_VERSION_ID'] = 'None.456'
-    self.assertIsNone(modules.get_current_version_name())
-
-  def testGetCurrentInstanceId(self):
-    os.environ['GAE_INSTANCE'] = 'instance1'
-    self.assertEqual('instance1', modules.get_current_instance_id())
-
-  def testGetCurrentInstanceId_Fallback(self):
-    if 'GAE_INSTANCE' in os.environ:
-        del os.environ['GAE_INSTANCE']
-    os.environ['INSTANCE_ID'] = 'instance2'
-    self.assertEqual('instance2', modules.get_current_instance_id())
-
-  def testGetCurrentInstanceId_None(self):
-    if 'GAE_INSTANCE' in os.environ:
-      del os.environ['GAE_INSTANCE']
-    if 'INSTANCE_ID' in os.environ:
-      del os.environ['INSTANCE_ID']
-    self.assertIsNone(modules.get_current_instance_id())
+  # --- Tests for _get_project_id ---
+
+  def testGetProjectId_FromGaeApplication(self):
+    del os.environ['GOOGLE_CLOUD_PROJECT']
+    os.environ['GAE_APPLICATION'] = 's~other-project'
+    self.assertEqual('other-project', modules._get_project_id())
+
+  def testGetProjectId_NoPartition(self):
+    del os.environ['GOOGLE_CLOUD_PROJECT']
+    os.environ['GAE_APPLICATION'] = 'other-project'
+    self.assertEqual('other-project', modules._get_project_id())
+
+  def testGetProjectId_Unset(self):
+    del os.environ['GOOGLE_CLOUD_PROJECT']
+    del os.environ['GAE_APPLICATION']
+    with self.assertRaises(modules.Error):
+      modules._get_project_id()
+
+  # --- Tests for the Admin API client cache ---
+
+  def testGetAdminApiClient_Cached(self):
+    build = self._SetupAdminApiMocks()
+    client = modules._get_admin_api_client_with_useragent('get_modules')
+    self.assertIs(self.mock_admin_api_client, client)
+    self.assertIs(client,
+                  modules._get_admin_api_client_with_useragent('get_modules'))
+    build.assert_called_once_with(
+        'appengine', 'v1', http=mock.ANY, requestBuilder=mock.ANY,
+        static_discovery=True)
+
+  def testBuildAdminApiClient_StaticDiscovery(self):
+    self._UseAdminApi()
+    self.addCleanup(modules._clear_admin_api_client_cache)
+    self.enter_context(mock.patch.object(discovery, 'build', _real_build))
+    # A discovery fetch would use up the only response and fail the call.
+    http = googleapiclient_http.HttpMockSequence([
+        ({'status': '200'}, json.dumps({'services': [{'id': 'default'}]})),
+    ])
+    self.enter_context(mock.patch.object(
+        modules, '_get_authorized_http', return_value=http))
+    self.assertEqual(['default'], modules.get_modules())
+    (_, _, _, headers), = http.request_sequence
+    self.assertEqual('appengine-modules-api-python-client/get_modules',
+                     headers['user-agent'].split(' ')[0])
+
+  def testGetAuthorizedHttp_ReusedPerThread(self):
+    self.addCleanup(modules._clear_admin_api_client_cache)
+    self.enter_context(mock.patch.object(
+        google.auth, 'default', return_value=(object(), 'project')))
+    authorized_http = modules._get_authorized_http()
+    self.assertIsInstance(authorized_http, google_auth_httplib2.AuthorizedHttp)
+    self.assertIs(authorized_http, modules._get_authorized_http())
+    other_thread_http = []
+    thread = threading.Thread(
+        target=lambda: other_thread_http.append(modules._get_authorized_http()))
+    thread.start()
+    thread.join()
+    self.assertIsNot(authorized_http, other_thread_http[0])
+    google.auth.default.assert_called_once_with()
+
+  def testWarmup(self):
+    self._UseAdminApi()
+    get_client = self._PatchAdminApiClient()
+    modules.warmup()
+    self.assertEqual(
+        [mock.call(method_name)
+         for method_name in modules._ADMIN_API_METHOD_NAMES],
+        get_client.call_args_list)
+
+  def testWarmup_NotOptedIn(self):
+    get_client = self._PatchAdminApiClient()
+    modules.warmup()
+    get_client.assert_not_called()
+
+  # --- Tests for _ThreadedRpc ---
+
+  def testThreadedRpc_RunsOnSharedPool(self):
+    thread_names = []
+    rpc = modules._ThreadedRpc(
+        lambda: thread_names.append(threading.current_thread().name))
+    self.assertIsNone(rpc.get_result())
+    self.assertLen(thread_names, 1)
+    self.assertTrue(thread_names[0].startswith('gae-modules-rpc'))
+
+  def testLazyExecutor_CreatedOnFirstUse(self):
+    executor = modules._LazyExecutor('TEST_WORKERS', 3, 'test-pool')
+    self.assertIsNone(executor._executor)
+    with mock.patch.dict(os.environ, {'TEST_WORKERS': '2'}):
+      self.assertEqual(executor.submit(lambda: 42).result(), 42)
+    self.assertEqual(executor._executor._max_workers, 2)
+    executor._executor.shutdown()
+
+  @parameterized.named_parameters(
+      ('Zero', '0'),
+      ('Negative', '-4'),
+      ('NotANumber', 'eight'),
+  )
+  def testLazyExecutor_InvalidWorkersFallsBack(self, value):
+    executor = modules._LazyExecutor('TEST_WORKERS', 3, 'test-pool')
+    with mock.patch.dict(os.environ, {'TEST_WORKERS': value}):
+      with self.assertLogs(level='WARNING') as logs:
+        self.assertEqual(executor.submit(lambda: 42).result(), 42)
+    self.assertEqual(executor._executor._max_workers, 3)
+    self.assertIn('TEST_WORKERS', logs.output[0])
+    executor._executor.shutdown()
+
+  def testThreadedRpc_RaisesTargetException(self):
+    def target():
+      raise modules.TransientError('boom')
+    rpc = modules._ThreadedRpc(target)
+    rpc.wait()
+    with self.assertRaisesRegex(modules.TransientError, 'boom'):
+      rpc.check_success()
+    with self.assertRaisesRegex(modules.TransientError, 'boom'):
+      rpc.get_result()
 
   def SetSuccessExpectations(self, method, expected_request, service_response):
     rpc = MockRpc(method, expected_request, service_response)
-    self.mox.StubOutWithMock(modules, '_GetRpc')
-    modules._GetRpc().AndReturn(rpc)
-    self.mox.ReplayAll()
+    self.enter_context(
+        mock.patch.object(modules, '_GetRpc', return_value=rpc))
 
   def SetExceptionExpectations(self, method, expected_request,
                                application_error_number):
     rpc = MockRpc(method, expected_request, None, application_error_number)
-    self.mox.StubOutWithMock(modules, '_GetRpc')
-    modules._GetRpc().AndReturn(rpc)
-    self.mox.ReplayAll()
+    self.enter_context(
+        mock.patch.object(modules, '_GetRpc', return_value=rpc))
 
   # --- Tests for updated get_modules ---
 
   def testGetModules(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_modules').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.list(appsId='project').AndReturn(mock_request)
-    mock_request.execute().AndReturn(
-        {'services': [{'id': 'module1'}, {'id': 'default'}]})
-    self.mox.ReplayAll()
-    self.assertEqual(['module1', 'default'], modules.get_modules())
+    self._UseAdminApi()
+    self.assertEqual(['module1', 'default'], self._CallReadApi(
+        modules.get_modules, 'services', 'list',
+        {'services': [{'id': 'module1'}, {'id': 'default'}]},
+        dict(appsId='project', fields='services/id')))
 
   def testGetModules_InvalidProject(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_modules').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.list(appsId='project').AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(404))
-    self.mox.ReplayAll()
-    with self.assertRaisesRegex(modules.Error, "Project 'project' not found."):
-      modules.get_modules()
+    self._UseAdminApi()
+    with self.assertRaisesRegex(modules.Error, _PROJECT_NOT_FOUND):
+      self._CallReadApi(
+          modules.get_modules, 'services', 'list', self._CreateHttpError(404),
+          dict(appsId='project', fields='services/id'))
+
+  @parameterized.named_parameters(
+      ('GetModules', modules.get_modules, 'services', 'list',
+       {'services': [{'id': 'default'}]}, ['default']),
+      ('GetVersions', modules.get_versions, 'versions', 'list',
+       {'versions': [{'id': 'v1'}, {'id': 'v2'}]}, ['v1', 'v2']),
+      ('GetDefaultVersion', modules.get_default_version, 'services', 'get',
+       {'split': {'allocations': {'v1': 1.0}}}, 'v1'),
+  )
+  def testReadApi_Cached(self, func, level, request, response, expected):
+    self._UseAdminApi()
+    get_client, resource = self._PatchAdminApi(level)
+    execute = getattr(resource, request).return_value.execute
+    execute.return_value = response
+    self.assertEqual(expected, func())
+    self.assertEqual(expected, func())
+    get_client.assert_called_once_with(func.__name__)
+    execute.assert_called_once_with()
+
+  def testGetVersions_ErrorNotCached(self):
+    self._UseAdminApi()
+    _, versions = self._PatchAdminApi('versions')
+    execute = versions.list.return_value.execute
+    execute.side_effect = [self._CreateHttpError(500),
+                           {'versions': [{'id': 'v1'}]}]
+    with self.assertRaises(modules.TransientError):
+      modules.get_versions()
+    self.assertEqual(['v1'], modules.get_versions())
+    self.assertEqual(2, execute.call_count)
+
+  @parameterized.named_parameters(
+      ('Unset', None, 60),
+      ('Valid', '5', 5.0),
+      ('Zero', '0', 0.0),
+      ('WithUnit', '5m', 60),
+      ('Negative', '-1', 60),
+  )
+  def testReadEnvNumber(self, value, expected):
+    environ = {} if value is None else {'MODULES_API_CACHE_TTL': value}
+    with mock.patch.dict(os.environ, environ):
+      self.assertEqual(expected, modules._read_env_number(
+          'MODULES_API_CACHE_TTL', 60, float, 0))
+
+  def testTTLCache(self):
+    cache = modules._TTLCache(60)
+    self.assertIsNone(cache.get('key'))
+    cache.set('key', 'value')
+    self.assertEqual('value', cache.get('key'))
+    cache.clear()
+    self.assertIsNone(cache.get('key'))
+
+  def testTTLCache_Expired(self):
+    cache = modules._TTLCache(0)
+    cache.set('key', 'value')
+    self.assertIsNone(cache.get('key'))
 
   # --- Tests for legacy get_modules ---
 
@@ -187,51 +472,22 @@ class ModulesTest(absltest.TestCase):
   # --- Tests for updated get_versions ---
 
   def testGetVersions(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_versions').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.list(
-        appsId='project', servicesId='default', view='FULL').AndReturn(
-            mock_request)
-    mock_request.execute().AndReturn({'versions': [{'id': 'v1'}, {'id': 'v2'}]})
-    self.mox.ReplayAll()
-    self.assertEqual(['v1', 'v2'], modules.get_versions())
+    self._UseAdminApi()
+    self.assertEqual(['v1', 'v2'], self._CallReadApi(
+        modules.get_versions, 'versions', 'list',
+        {'versions': [{'id': 'v1'}, {'id': 'v2'}]},
+        dict(appsId='project', servicesId='default', fields='versions/id')))
 
   def testGetVersions_InvalidModule(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_versions').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.list(
-        appsId='project', servicesId='foo', view='FULL').AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(404))
-    self.mox.ReplayAll()
-    with self.assertRaisesRegex(modules.InvalidModuleError,
-                                  ""):
-      modules.get_versions(module='foo')
-      
+    self._UseAdminApi()
+    with self.assertRaises(modules.InvalidModuleError):
+      self._CallReadApi(
+          modules.get_versions, 'versions', 'list', self._CreateHttpError(404),
+          dict(appsId='project', servicesId='foo', fields='versions/id'),
+          module='foo')
+
   # --- Tests for Legacy get_versions ---
-  
+
   def testGetVersionsLegacy(self):
     """Test we return the expected results."""
     expected_request = modules_service_pb2.GetVersionsRequest()
@@ -272,105 +528,47 @@ class ModulesTest(absltest.TestCase):
   # --- Tests for updated get_default_version ---
 
   def testGetDefaultVersion(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-
-    mock_admin_api_client = self.mox.CreateMockAnything()
-
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent(
-        'get_default_version').AndReturn(mock_admin_api_client)
-
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-
-    mock_admin_api_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.get(appsId='project',
-                      servicesId='default').AndReturn(mock_request)
-    mock_request.execute().AndReturn(
-        {'split': {'allocations': {'v1': 0.5, 'v2': 0.5}}})
-
-    self.mox.ReplayAll()
-
-    # The assertion remains the same
-    self.assertEqual('v1', modules.get_default_version())
+    self._UseAdminApi()
+    self.assertEqual('v1', self._CallReadApi(
+        modules.get_default_version, 'services', 'get',
+        {'split': {'allocations': {'v1': 0.5, 'v2': 0.5}}},
+        dict(appsId='project', servicesId='default',
+             fields='split/allocations')))
 
   def testGetDefaultVersion_Lexicographical(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_admin_api_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent(
-        'get_default_version').AndReturn(mock_admin_api_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_admin_api_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.get(appsId='project',
-                      servicesId='default').AndReturn(mock_request)
-    mock_request.execute().AndReturn(
-        {'split': {'allocations': {'v2-beta': 0.5, 'v1-stable': 0.5}}})
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    _, services = self._PatchAdminApi('services')
+    services.get.return_value.execute.return_value = {
+        'split': {'allocations': {'v2-beta': 0.5, 'v1-stable': 0.5}}}
     self.assertEqual('v1-stable', modules.get_default_version())
 
+  def testGetDefaultVersion_LargestAllocation(self):
+    self._UseAdminApi()
+    _, services = self._PatchAdminApi('services')
+    services.get.return_value.execute.return_value = {
+        'split': {'allocations': {'a': 0.2, 'c': 0.4, 'b': 0.4}}}
+    self.assertEqual('b', modules.get_default_version())
 
   def testGetDefaultVersion_NoDefaultVersion(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_admin_api_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent(
-        'get_default_version').AndReturn(mock_admin_api_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_admin_api_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.get(appsId='project',
-                      servicesId='default').AndReturn(mock_request)
-    mock_request.execute().AndReturn({})
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    _, services = self._PatchAdminApi('services')
+    services.get.return_value.execute.return_value = {}
     with self.assertRaisesRegex(modules.InvalidVersionError,
                                   'Could not determine default version'):
       modules.get_default_version()
 
   def testGetDefaultVersion_InvalidModule(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-
-    mock_admin_api_client = self.mox.CreateMockAnything()
-
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent(
-        'get_default_version').AndReturn(mock_admin_api_client)
-
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-
-    mock_admin_api_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.get(appsId='project',
-                      servicesId='foo').AndReturn(mock_request)
-
-    mock_request.execute().AndRaise(self._CreateHttpError(404))
-
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    with self.assertRaises(modules.InvalidModuleError):
+      self._CallReadApi(
+          modules.get_default_version, 'services', 'get',
+          self._CreateHttpError(404),
+          dict(appsId='project', servicesId='foo',
+               fields='split/allocations'),
+          module='foo')
 
-    with self.assertRaisesRegex(modules.InvalidModuleError,
-                                  ""):
-      modules.get_default_version(module='foo')
-      
   # --- Tests for legacy get_default_version ---
-  
+
   def testGetDefaultVersionLegacy(self):
     """Test we return the expected results."""
     expected_request = modules_service_pb2.GetDefaultVersionRequest()
@@ -405,87 +603,41 @@ class ModulesTest(absltest.TestCase):
         'GetDefaultVersion', modules_service_pb2.GetDefaultVersionRequest(),
         modules_service_pb2.ModulesServiceError.INVALID_VERSION)
     self.assertRaises(modules.InvalidVersionError, modules.get_default_version)
-  
+
   # --- Tests for updated get_num_instances ---
 
   def testGetNumInstances(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_num_instances').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.get(appsId='project', servicesId='default',
-                      versionsId='v1').AndReturn(mock_request)
-    mock_request.execute().AndReturn({'manualScaling': {'instances': 5}})
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    get_client, versions = self._PatchAdminApi('versions')
+    versions.get.return_value.execute.return_value = {
+        'manualScaling': {'instances': 5}}
     self.assertEqual(5, modules.get_num_instances())
+    # The second call is served from the instance count cache.
+    self.assertEqual(5, modules.get_num_instances('default', 'v1'))
+    get_client.assert_called_once_with('get_num_instances')
+    versions.get.assert_called_once_with(
+        appsId='project', servicesId='default', versionsId='v1',
+        fields='manualScaling')
 
   def testGetNumInstances_NoManualScaling(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_num_instances').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.get(appsId='project', servicesId='default',
-                      versionsId='v1').AndReturn(mock_request)
-    mock_request.execute().AndReturn({'automaticScaling': {}})
-    self.mox.ReplayAll()
-
+    self._UseAdminApi()
+    _, versions = self._PatchAdminApi('versions')
+    versions.get.return_value.execute.return_value = {'automaticScaling': {}}
     with self.assertRaises(modules.InvalidVersionError):
       modules.get_num_instances()
 
   def testGetNumInstances_InvalidVersion(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_num_instances').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.get(appsId='project', servicesId='default',
-                      versionsId='v-bad').AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(404))
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    _, versions = self._PatchAdminApi('versions')
+    versions.get.return_value.execute.side_effect = self._CreateHttpError(404)
     with self.assertRaises(modules.InvalidModuleError):
       modules.get_num_instances(version='v-bad')
+    versions.get.assert_called_once_with(
+        appsId='project', servicesId='default', versionsId='v-bad',
+        fields='manualScaling')
 
   # --- Tests for updated get_num_instances ---
-  
+
   def testGetNumInstancesLegacy(self):
     """Test we return the expected results."""
     expected_request = modules_service_pb2.GetNumInstancesRequest()
@@ -539,74 +691,42 @@ class ModulesTest(absltest.TestCase):
         'GetNumInstances', expected_request,
         modules_service_pb2.ModulesServiceError.INVALID_VERSION)
     self.assertRaises(modules.InvalidVersionError,
-                      modules.get_num_instances, 'module1', 'v1')  
-  
+                      modules.get_num_instances, 'module1', 'v1')
+
   # --- Tests for updated set_num_instances---
 
   def testSetNumInstances(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('set_num_instances').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
+    self._UseAdminApi()
+    get_client, versions = self._PatchAdminApi('versions')
+    modules.set_num_instances(10)
+    get_client.assert_called_once_with('set_num_instances')
+    versions.patch.assert_called_once_with(
         appsId='project',
         servicesId='default',
         versionsId='v1',
         updateMask='manualScaling.instances',
-        body={'manualScaling': {'instances': 10}}).AndReturn(mock_request)
-    mock_request.execute()
-    self.mox.ReplayAll()
-    modules.set_num_instances(10)
+        body={'manualScaling': {'instances': 10}})
+    versions.patch.return_value.execute.assert_called_once_with()
+
+  def testSetNumInstances_UpdatesNumInstancesCache(self):
+    self._UseAdminApi()
+    get_client, versions = self._PatchAdminApi('versions')
+    modules.set_num_instances(7, 'module1', 'v2')
+    self.assertEqual(7, modules.get_num_instances('module1', 'v2'))
+    get_client.assert_called_once_with('set_num_instances')
+    versions.patch.assert_called_once_with(
+        appsId='project',
+        servicesId='module1',
+        versionsId='v2',
+        updateMask='manualScaling.instances',
+        body={'manualScaling': {'instances': 7}})
+    versions.get.assert_not_called()
 
   def testSetNumInstances_TypeError(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
+    self._UseAdminApi()
     with self.assertRaises(TypeError):
       modules.set_num_instances('not-an-int')
 
-  def testSetNumInstances_InvalidInstancesError(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('set_num_instances').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
-        appsId='project',
-        servicesId='default',
-        versionsId='v1',
-        updateMask='manualScaling.instances',
-        body={'manualScaling': {'instances': -1}}).AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(400))
-    self.mox.ReplayAll()
-    with self.assertRaises(modules.InvalidInstancesError):
-      modules.set_num_instances(-1)
-      
   # --- Tests for legacy set_num_instances---
 
   def testSetNumInstancesLegacy(self):
@@ -679,88 +799,32 @@ class ModulesTest(absltest.TestCase):
   # --- Tests for updated start_version---
 
   def testStartVersion(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('start_version').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
-        appsId='project',
-        servicesId='default',
-        versionsId='v1',
-        updateMask='servingStatus',
-        body={'servingStatus': 'SERVING'}).AndReturn(mock_request)
-    mock_request.execute()
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    get_client, versions = self._PatchAdminApi('versions')
     modules.start_version('default', 'v1')
-
-  def testStartVersion_InvalidVersion(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('start_version').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
+    get_client.assert_called_once_with('start_version')
+    versions.patch.assert_called_once_with(
         appsId='project',
         servicesId='default',
-        versionsId='v-bad',
+        versionsId='v1',
         updateMask='servingStatus',
-        body={'servingStatus': 'SERVING'}).AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(404))
-    self.mox.ReplayAll()
-    with self.assertRaises(modules.InvalidVersionError):
-      modules.start_version('default', 'v-bad')
+        body=_SERVING)
+    versions.patch.return_value.execute.assert_called_once_with()
 
   def testStartVersionAsync_NoneArgs(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('start_version').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
+    self._UseAdminApi()
+    _, versions = self._PatchAdminApi('versions')
+    rpc = modules.start_version_async(None, None)
+    rpc.get_result()
+    versions.patch.assert_called_once_with(
         appsId='project',
         servicesId='default',
         versionsId='v1',
         updateMask='servingStatus',
-        body={'servingStatus': 'SERVING'}).AndReturn(mock_request)
-    mock_request.execute()
-    self.mox.ReplayAll()
-    rpc = modules.start_version_async(None, None)
-    rpc.get_result()
+        body=_SERVING)
 
   # --- Tests for legacy start_version---
-  
+
   def testStartVersionLegacy(self):
     """Test we pass through the expected args."""
     expected_request = modules_service_pb2.StartModuleRequest()
@@ -790,13 +854,13 @@ class ModulesTest(absltest.TestCase):
     expected_request = modules_service_pb2.StartModuleRequest()
     expected_request.module = 'module1'
     expected_request.version = 'v1'
-    self.mox.StubOutWithMock(logging, 'info')
-    logging.info('The specified module: module1, version: v1 is already '
-                 'started.')
+    mock_info = self.enter_context(mock.patch.object(logging, 'info'))
     self.SetExceptionExpectations(
         'StartModule', expected_request,
         modules_service_pb2.ModulesServiceError.UNEXPECTED_STATE)
     modules.start_version('module1', 'v1')
+    mock_info.assert_called_once_with(
+        'The specified module: module1, version: v1 is already started.')
 
   def testStartVersionLegacy_TransientError(self):
     """Test we raise an error when we receive one from the API."""
@@ -810,98 +874,102 @@ class ModulesTest(absltest.TestCase):
                       modules.start_version,
                       'module1',
                       'v1')
-  
-  # --- Tests for updated stop_version---  
+
+  # --- Tests for updated stop_version---
 
   def testStopVersion(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('stop_version').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
-        appsId='project',
-        servicesId='default',
-        versionsId='v1',
-        updateMask='servingStatus',
-        body={'servingStatus': 'STOPPED'}).AndReturn(mock_request)
-    mock_request.execute()
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    get_client, versions = self._PatchAdminApi('versions')
     modules.stop_version()
-
-  def testStopVersion_InvalidVersion(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('stop_version').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
-        appsId='project',
-        servicesId='default',
-        versionsId='v-bad',
-        updateMask='servingStatus',
-        body={'servingStatus': 'STOPPED'}).AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(404))
-    self.mox.ReplayAll()
-    with self.assertRaises(modules.InvalidVersionError):
-      modules.stop_version(version='v-bad')
-
-  def testStopVersion_TransientError(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('stop_version').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
+    get_client.assert_called_once_with('stop_version')
+    versions.patch.assert_called_once_with(
         appsId='project',
         servicesId='default',
         versionsId='v1',
         updateMask='servingStatus',
-        body={'servingStatus': 'STOPPED'}).AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(500))
-    self.mox.ReplayAll()
-    with self.assertRaises(modules.TransientError):
-      modules.stop_version()
+        body=_STOPPED)
+    versions.patch.return_value.execute.assert_called_once_with()
+
+  def testStopVersions(self):
+    stop_version_async = self.enter_context(
+        mock.patch.object(modules, 'stop_version_async'))
+    stop_version_async.side_effect = [
+        modules._ThreadedRpc(lambda: None),
+        modules._ThreadedRpc(lambda: None),
+    ]
+    modules.stop_versions([('module1', 'v1'), ('module2', 'v2')])
+    self.assertEqual(
+        [mock.call('module1', 'v1'), mock.call('module2', 'v2')],
+        stop_version_async.call_args_list)
+
+  def testStopVersions_RaisesFirstError(self):
+    def fail():
+      raise modules.InvalidVersionError()
+    # Keeps the first stop pending so the error must be raised without it.
+    release = threading.Event()
+    self.addCleanup(release.set)
+    stop_version_async = self.enter_context(
+        mock.patch.object(modules, 'stop_version_async'))
+    stop_version_async.side_effect = [
+        modules._ThreadedRpc(release.wait),
+        modules._ThreadedRpc(fail),
+    ]
+    with self.assertRaises(modules.InvalidVersionError):
+      modules.stop_versions([('module1', 'v1'), ('module2', 'v-bad')])
+
+  def testStopVersions_Legacy(self):
+    """Legacy UserRPCs are not waited on as futures but joined in order."""
+    rpcs = []
+    for module in ('module1', 'module2'):
+      expected_request = modules_service_pb2.StopModuleRequest()
+      expected_request.module = module
+      expected_request.version = 'v1'
+      rpcs.append(MockRpc('StopModule', expected_request,
+                          modules_service_pb2.StopModuleResponse()))
+    self.enter_context(mock.patch.object(modules, '_GetRpc', side_effect=rpcs))
+    get_result = self.enter_context(mock.patch.object(
+        MockRpc, 'get_result', autospec=True, side_effect=MockRpc.get_result))
+    modules.stop_versions([('module1', 'v1'), ('module2', 'v1')])
+    self.assertEqual([mock.call(rpcs[0]), mock.call(rpcs[1])],
+                     get_result.call_args_list)
+
+  def testStartVersions(self):
+    self._UseAdminApi()
+    _, versions = self._PatchAdminApi('versions')
+    modules.start_versions([('module1', 'v1'), ('module2', 'v2')])
+    self.assertCountEqual(
+        [mock.call(appsId='project', servicesId='module1', versionsId='v1',
+                   updateMask='servingStatus', body=_SERVING),
+         mock.call(appsId='project', servicesId='module2', versionsId='v2',
+                   updateMask='servingStatus', body=_SERVING)],
+        versions.patch.call_args_list)
+    self.assertEqual(2, versions.patch.return_value.execute.call_count)
+
+  def testSetNumInstancesBulk(self):
+    self._UseAdminApi()
+    _, versions = self._PatchAdminApi('versions')
+    modules.set_num_instances_bulk([(3, 'module1', 'v1'), (5, 'module2', 'v2')])
+    self.assertCountEqual(
+        [mock.call(appsId='project', servicesId='module1', versionsId='v1',
+                   updateMask='manualScaling.instances',
+                   body={'manualScaling': {'instances': 3}}),
+         mock.call(appsId='project', servicesId='module2', versionsId='v2',
+                   updateMask='manualScaling.instances',
+                   body={'manualScaling': {'instances': 5}})],
+        versions.patch.call_args_list)
+    self.assertEqual(2, versions.patch.return_value.execute.call_count)
+
+  def testSetNumInstancesBulk_TypeErrorSendsNothing(self):
+    self._UseAdminApi()
+    set_num_instances_async = self.enter_context(
+        mock.patch.object(modules, 'set_num_instances_async'))
+    with self.assertRaises(TypeError):
+      modules.set_num_instances_bulk(
+          iter([(3, 'module1', 'v1'), ('5', 'module2', 'v2')]))
+    set_num_instances_async.assert_not_called()
 
   # --- Tests for legacy stop_version--
-  
+
   def testStopVersionLegacy_NoModule(self):
     """Test we pass through the expected args."""
     expected_request = modules_service_pb2.StopModuleRequest()
@@ -940,13 +1008,13 @@ class ModulesTest(absltest.TestCase):
     expected_request = modules_service_pb2.StopModuleRequest()
     expected_request.module = 'module1'
     expected_request.version = 'v1'
-    self.mox.StubOutWithMock(logging, 'info')
-    logging.info('The specified module: module1, version: v1 is already '
-                 'stopped.')
+    mock_info = self.enter_context(mock.patch.object(logging, 'info'))
     self.SetExceptionExpectations(
         'StopModule', expected_request,
         modules_service_pb2.ModulesServiceError.UNEXPECTED_STATE)
     modules.stop_version('module1', 'v1')
+    mock_info.assert_called_once_with(
+        'The specified module: module1, version: v1 is already stopped.')
 
   def testStopVersionLegacy_TransientError(self):
     """Test we raise an error when we receive one from the API."""
@@ -955,273 +1023,245 @@ class ModulesTest(absltest.TestCase):
         modules_service_pb2.ModulesServiceError.TRANSIENT_ERROR)
     self.assertRaises(modules.TransientError, modules.stop_version)
 
-  def testRaiseError_Generic(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent(mox.IsA(str)).AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.patch(
-        appsId='project',
-        servicesId='default',
-        versionsId='v1',
-        updateMask='servingStatus',
-        body={'servingStatus': 'STOPPED'}).AndReturn(mock_request)
-    mock_request.execute().AndRaise(self._CreateHttpError(401)) # Unauthorized
-    self.mox.ReplayAll()
-    with self.assertRaises(modules.Error):
-        modules.stop_version()
+  # --- Tests for Admin API PATCH errors ---
+
+  @parameterized.named_parameters(
+      ('StopVersion_InvalidVersion', 404, modules.InvalidVersionError,
+       lambda: modules.stop_version(version='v-bad'),
+       dict(versionsId='v-bad', updateMask='servingStatus', body=_STOPPED)),
+      ('StopVersion_TransientError', 500, modules.TransientError,
+       lambda: modules.stop_version(),
+       dict(versionsId='v1', updateMask='servingStatus', body=_STOPPED)),
+      ('StopVersion_Unauthorized', 401, modules.Error,
+       lambda: modules.stop_version(),
+       dict(versionsId='v1', updateMask='servingStatus', body=_STOPPED)),
+      ('StartVersion_InvalidVersion', 404, modules.InvalidVersionError,
+       lambda: modules.start_version('default', 'v-bad'),
+       dict(versionsId='v-bad', updateMask='servingStatus', body=_SERVING)),
+      ('SetNumInstances_InvalidInstances', 400, modules.InvalidInstancesError,
+       lambda: modules.set_num_instances(-1),
+       dict(versionsId='v1', updateMask='manualScaling.instances',
+            body={'manualScaling': {'instances': -1}})),
+  )
+  def testPatchVersionError(self, status, error, call, patch_kwargs):
+    self._UseAdminApi()
+    _, versions = self._PatchAdminApi('versions')
+    versions.patch.return_value.execute.side_effect = (
+        self._CreateHttpError(status))
+    with self.assertRaises(error):
+      call()
+    versions.patch.assert_called_once_with(
+        appsId='project', servicesId='default', **patch_kwargs)
 
    # --- Tests for updated get_hostname ---
 
   def testGetHostname_WithVersion_NoInstance(self):
     """Tests the simple case with an explicit module and version."""
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_admin_api_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent(
-        'get_hostname').AndReturn(mock_admin_api_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_modules')
-    modules.get_modules().AndReturn(['default', 'other', 'foo'])
-    mock_apps = self.mox.CreateMockAnything()
-    mock_get_request = self.mox.CreateMockAnything()
-    mock_admin_api_client.apps().AndReturn(mock_apps)
-    mock_apps.get(appsId='project').AndReturn(mock_get_request)
-    mock_get_request.execute().AndReturn(
-        {'defaultHostname': 'project.appspot.com'})
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    get_client, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'other', 'foo']))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
+    self.assertEqual('v2.foo.project.appspot.com',
+                     modules.get_hostname(module='foo', version='v2'))
+    get_client.assert_called_once_with('get_hostname')
+    apps.get.assert_called_once_with(
+        appsId='project', fields='defaultHostname')
+
+  def testGetHostname_DefaultHostnameFetchedOnce(self):
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'foo']))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
     self.assertEqual('v2.foo.project.appspot.com',
                      modules.get_hostname(module='foo', version='v2'))
+    self.assertEqual('v3.foo.project.appspot.com',
+                     modules.get_hostname(module='foo', version='v3'))
+    apps.get.assert_called_once_with(
+        appsId='project', fields='defaultHostname')
 
   def testGetHostname_Instance_Success(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client_1 = self.mox.CreateMockAnything()
-    mock_client_2 = self.mox.CreateMockAnything()
-
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent(
-        'get_hostname').AndReturn(mock_client_1)
-    self.mox.StubOutWithMock(modules.discovery, 'build')
-    modules.discovery.build('appengine', 'v1').AndReturn(mock_client_2)
-
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_modules')
-    modules.get_modules().AndReturn(['default', 'other'])
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-
-    mock_apps_1 = self.mox.CreateMockAnything()
-    mock_get_request = self.mox.CreateMockAnything()
-    mock_client_1.apps().AndReturn(mock_apps_1)
-    mock_apps_1.get(appsId='project').AndReturn(mock_get_request)
-    mock_get_request.execute().AndReturn(
-        {'defaultHostname': 'project.appspot.com'})
-
-    mock_apps_2 = self.mox.CreateMockAnything()
-    mock_services_2 = self.mox.CreateMockAnything()
-    mock_versions_2 = self.mox.CreateMockAnything()
-    mock_version_request = self.mox.CreateMockAnything()
-    mock_client_2.apps().AndReturn(mock_apps_2)
-    mock_apps_2.services().AndReturn(mock_services_2)
-    mock_services_2.versions().AndReturn(mock_versions_2)
-    mock_versions_2.get(
-        appsId='project', servicesId='default', versionsId='v1',
-        view='FULL').AndReturn(mock_version_request)
-    mock_version_request.execute().AndReturn(
-        {'manualScaling': {'instances': 5}})
-
-    self.mox.ReplayAll()
-
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'other']))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
+    versions = _Chain(apps, 'services', 'versions')
+    versions.get.return_value.execute.return_value = {
+        'manualScaling': {'instances': 5}}
     self.assertEqual('2.v1.default.project.appspot.com',
                      modules.get_hostname(instance='2'))
-
+    versions.get.assert_called_once_with(
+        appsId='project', servicesId='default', versionsId='v1',
+        fields='manualScaling')
 
   def testGetHostname_Instance_NoManualScaling(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client_1 = self.mox.CreateMockAnything()
-    mock_client_2 = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_hostname').AndReturn(mock_client_1)
-    self.mox.StubOutWithMock(modules.discovery, 'build')
-    modules.discovery.build('appengine', 'v1').AndReturn(mock_client_2)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_modules')
-    modules.get_modules().AndReturn(['default', 'other'])
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-    mock_apps_1 = self.mox.CreateMockAnything()
-    mock_get_request = self.mox.CreateMockAnything()
-    mock_client_1.apps().AndReturn(mock_apps_1)
-    mock_apps_1.get(appsId='project').AndReturn(mock_get_request)
-    mock_get_request.execute().AndReturn(
-        {'defaultHostname': 'project.appspot.com'})
-    mock_apps_2 = self.mox.CreateMockAnything()
-    mock_services_2 = self.mox.CreateMockAnything()
-    mock_versions_2 = self.mox.CreateMockAnything()
-    mock_version_request = self.mox.CreateMockAnything()
-    mock_client_2.apps().AndReturn(mock_apps_2)
-    mock_apps_2.services().AndReturn(mock_services_2)
-    mock_services_2.versions().AndReturn(mock_versions_2)
-    mock_versions_2.get(
-        appsId='project', servicesId='default', versionsId='v1',
-        view='FULL').AndReturn(mock_version_request)
-    mock_version_request.execute().AndReturn({'automaticScaling': {}})
-    self.mox.ReplayAll()
-    with self.assertRaisesRegex(
-        modules.InvalidInstancesError,
-        'Instance-specific hostnames are only available for manually scaled '
-        'services.'):
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'other']))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
+    versions = _Chain(apps, 'services', 'versions')
+    versions.get.return_value.execute.return_value = {'automaticScaling': {}}
+    with self.assertRaisesRegex(modules.InvalidInstancesError,
+                                _NOT_MANUALLY_SCALED):
       modules.get_hostname(instance='1')
 
   def testGetHostname_Instance_OutOfBounds(self):
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_api_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(google.auth, 'default')
-    google.auth.default().AndReturn((None, 'project'))
-    
-    self.mox.StubOutWithMock(modules.discovery, 'build')
-    modules.discovery.build('appengine', 'v1', http=mox.IsA(object)).AndReturn(mock_api_client)
-    modules.discovery.build('appengine', 'v1').AndReturn(mock_api_client)
-
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_modules')
-    modules.get_modules().AndReturn(['default', 'other'])
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-    mock_apps = self.mox.CreateMockAnything()
-    mock_get_request = self.mox.CreateMockAnything()
-    mock_services = self.mox.CreateMockAnything()
-    mock_versions = self.mox.CreateMockAnything()
-    mock_version_request = self.mox.CreateMockAnything()
-    mock_api_client.apps().AndReturn(mock_apps)
-    mock_apps.get(appsId='project').AndReturn(mock_get_request)
-    mock_get_request.execute().AndReturn(
-        {'defaultHostname': 'project.appspot.com'})
-    mock_api_client.apps().AndReturn(mock_apps)
-    mock_apps.services().AndReturn(mock_services)
-    mock_services.versions().AndReturn(mock_versions)
-    mock_versions.get(
-        appsId='project', servicesId='default', versionsId='v1',
-        view='FULL').AndReturn(mock_version_request)
-    mock_version_request.execute().AndReturn(
-        {'manualScaling': {'instances': 5}})
-    self.mox.ReplayAll()
-    with self.assertRaisesRegex(
-        modules.InvalidInstancesError,
-        'The specified instance does not exist for this module/version.'):
+    self._UseAdminApi()
+    mock_api_client = mock.MagicMock()
+    self._SetupAdminApiMocks(mock_api_client)
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'other']))
+    apps = _Chain(mock_api_client, 'apps')
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
+    versions = _Chain(apps, 'services', 'versions')
+    versions.get.return_value.execute.return_value = {
+        'manualScaling': {'instances': 5}}
+    with self.assertRaisesRegex(modules.InvalidInstancesError,
+                                _NO_SUCH_INSTANCE):
       modules.get_hostname(instance='5')
 
   def testGetHostname_Instance_InvalidValue(self):
     """Tests instance request with an invalid non-integer instance value."""
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    with self.assertRaisesRegex(
-        modules.InvalidInstancesError,
-        'Instance must be a non-negative integer.'):
+    self._UseAdminApi()
+    with self.assertRaisesRegex(modules.InvalidInstancesError,
+                                _INSTANCE_NOT_AN_INTEGER):
       modules.get_hostname(instance='foo')
 
   def testGetHostname_NoVersion_VersionExistsOnTarget(self):
     """Tests no-version call where the current version exists on the target."""
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_hostname').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_modules')
-    modules.get_modules().AndReturn(['default', 'module1'])
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-    self.mox.StubOutWithMock(modules, 'get_versions')
-    modules.get_versions(module='module1').AndReturn(['v1', 'v2'])
-    mock_apps = self.mox.CreateMockAnything()
-    mock_get_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.get(appsId='project').AndReturn(mock_get_request)
-    mock_get_request.execute().AndReturn(
-        {'defaultHostname': 'project.appspot.com'})
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'module1']))
+    get_versions = self.enter_context(mock.patch.object(
+        modules, 'get_versions', return_value=['v1', 'v2']))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
     self.assertEqual('v1.module1.project.appspot.com',
                      modules.get_hostname(module='module1'))
+    get_versions.assert_called_once_with(module='module1')
 
   def testGetHostname_NoVersion_VersionDoesNotExistOnTarget(self):
     """Tests no-version call where the current version is not on the target."""
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_hostname').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_modules')
-    modules.get_modules().AndReturn(['default', 'module1'])
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-    self.mox.StubOutWithMock(modules, 'get_versions')
-    modules.get_versions(module='module1').AndReturn(['v2', 'v3'])
-    mock_apps = self.mox.CreateMockAnything()
-    mock_get_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.get(appsId='project').AndReturn(mock_get_request)
-    mock_get_request.execute().AndReturn(
-        {'defaultHostname': 'project.appspot.com'})
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'module1']))
+    get_versions = self.enter_context(mock.patch.object(
+        modules, 'get_versions', return_value=['v2', 'v3']))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
     self.assertEqual('module1.project.appspot.com',
                      modules.get_hostname(module='module1'))
+    get_versions.assert_called_once_with(module='module1')
 
   def testGetHostname_LegacyApp_Success(self):
     """Tests a hostname request for a legacy app without engines."""
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    mock_client = self.mox.CreateMockAnything()
-    self.mox.StubOutWithMock(modules, '_get_admin_api_client_with_useragent')
-    modules._get_admin_api_client_with_useragent('get_hostname').AndReturn(mock_client)
-    self.mox.StubOutWithMock(modules, '_get_project_id')
-    modules._get_project_id().AndReturn('project')
-    self.mox.StubOutWithMock(modules, 'get_modules')
-    modules.get_modules().AndReturn(['default'])
-    self.mox.StubOutWithMock(modules, 'get_current_module_name')
-    modules.get_current_module_name().AndReturn('default')
-    self.mox.StubOutWithMock(modules, 'get_current_version_name')
-    modules.get_current_version_name().AndReturn('v1')
-    mock_apps = self.mox.CreateMockAnything()
-    mock_get_request = self.mox.CreateMockAnything()
-    mock_client.apps().AndReturn(mock_apps)
-    mock_apps.get(appsId='project').AndReturn(mock_get_request)
-    mock_get_request.execute().AndReturn(
-        {'defaultHostname': 'project.appspot.com'})
-    self.mox.ReplayAll()
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default']))
+    get_versions = self.enter_context(mock.patch.object(
+        modules, 'get_versions', return_value=['v1']))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
     self.assertEqual('v1.project.appspot.com', modules.get_hostname())
+    get_versions.assert_not_called()
+
+  def testGetHostname_InvalidModule_SkipsVersions(self):
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', return_value=['default', 'module1']))
+    get_versions = self.enter_context(mock.patch.object(modules, 'get_versions'))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
+    with self.assertRaises(modules.InvalidModuleError):
+      modules.get_hostname(module='module2')
+    get_versions.assert_not_called()
+
+  def testGetHostname_ReadsOffThePatchPool(self):
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    thread_names = []
+    def get_modules():
+      thread_names.append(threading.current_thread().name)
+      return ['default']
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', side_effect=get_modules))
+    apps.get.return_value.execute.return_value = {
+        'defaultHostname': 'project.appspot.com'}
+    self.assertEqual('v1.project.appspot.com', modules.get_hostname())
+    self.assertLen(thread_names, 1)
+    self.assertTrue(thread_names[0].startswith('gae-modules-read'))
+
+  def testGetHostname_CachedHostname_ReadsInline(self):
+    self._UseAdminApi()
+    _, apps = self._PatchAdminApi('apps')
+    modules._default_hostnames['project'] = 'project.appspot.com'
+    thread_names = []
+    def get_modules():
+      thread_names.append(threading.current_thread().name)
+      return ['default']
+    self.enter_context(mock.patch.object(
+        modules, 'get_modules', side_effect=get_modules))
+    submit = self.enter_context(
+        mock.patch.object(modules._read_executor, 'submit'))
+    self.assertEqual('v1.project.appspot.com', modules.get_hostname())
+    submit.assert_not_called()
+    apps.get.assert_not_called()
+    self.assertEqual([threading.current_thread().name], thread_names)
 
   def testGetHostname_LegacyApp_WithInstance(self):
     """Tests a legacy app request with an invalid non-integer instance."""
-    os.environ['MODULES_USE_ADMIN_API'] = 'true'
-    with self.assertRaisesRegex(
-        modules.InvalidInstancesError,
-        'Instance must be a non-negative integer.'):
+    self._UseAdminApi()
+    with self.assertRaisesRegex(modules.InvalidInstancesError,
+                                _INSTANCE_NOT_AN_INTEGER):
       modules.get_hostname(instance='i')
-      
+
+  # --- Tests against a client built from the discovery document ---
+
+  def testGetModules_DiscoveryClient(self):
+    self._UseAdminApi()
+    http = self._UseDiscoveryClient([
+        ({'status': '200'},
+         json.dumps({'services': [{'id': 'default'}, {'id': 'module1'}]})),
+    ])
+    self.assertEqual(['default', 'module1'], modules.get_modules())
+    (uri, method, _, _), = http.request_sequence
+    self.assertEqual('GET', method)
+    self.assertEqual(
+        'https://appengine.googleapis.com/v1/apps/project/services'
+        '?fields=services%2Fid&alt=json', uri)
+
+  def testSetNumInstances_DiscoveryClient(self):
+    self._UseAdminApi()
+    http = self._UseDiscoveryClient([({'status': '200'}, '{}')])
+    modules.set_num_instances(3, 'module1', 'v2')
+    (uri, method, body, _), = http.request_sequence
+    self.assertEqual('PATCH', method)
+    self.assertEqual(
+        'https://appengine.googleapis.com/v1/apps/project/services/module1'
+        '/versions/v2?updateMask=manualScaling.instances&alt=json', uri)
+    self.assertEqual({'manualScaling': {'instances': 3}}, json.loads(body))
+
+  def testStopVersion_DiscoveryClient_InvalidVersion(self):
+    self._UseAdminApi()
+    self._UseDiscoveryClient([
+        ({'status': '404', 'reason': 'Not Found'},
+         json.dumps({'error': {'code': 404, 'message': 'Not found'}})),
+    ])
+    with self.assertRaises(modules.InvalidVersionError):
+      modules.stop_version('default', 'v-bad')
+
    # --- Tests for Legacy get_hostname ---
 
   def testGetHostnameLegacy(self):